@@ -1,10 +1,14 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
 import io
+import time
+import difflib
+import unicodedata
 from fpdf import FPDF
 import pytz
+from storage import SQLiteBackend, PostgresBackend, ORIGEN_IMPORTACION
 
 # --- CONFIGURACIÓN ---
 st.set_page_config(page_title="Sistema Heladería Master", layout="wide", page_icon="🍦")
@@ -42,59 +46,24 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- BASE DE DATOS Y MIGRACIÓN AUTOMÁTICA ---
-def init_and_migrate_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    # Tablas base
-    c.execute('''CREATE TABLE IF NOT EXISTS menu (id INTEGER PRIMARY KEY, nombre TEXT, precio REAL, categoria TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS insumos (id INTEGER PRIMARY KEY, nombre TEXT, cantidad REAL, unidad TEXT, minimo REAL DEFAULT 10)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS recetas (id INTEGER PRIMARY KEY, menu_id INTEGER, insumo_id INTEGER, cantidad_insumo REAL)''')
-    
-    # VENTAS ACTUALIZADA: Ahora guarda cant_toppings y cant_conos para poder devolverlos
-    c.execute('''CREATE TABLE IF NOT EXISTS ventas (id INTEGER PRIMARY KEY, producto_nombre TEXT, precio_base REAL, cantidad INTEGER, extras REAL, total REAL, metodo_pago TEXT, fecha TIMESTAMP, cant_toppings INTEGER DEFAULT 0, cant_conos INTEGER DEFAULT 0)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS mermas (id INTEGER PRIMARY KEY, insumo_nombre TEXT, cantidad REAL, razon TEXT, fecha TIMESTAMP)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS movimientos (id INTEGER PRIMARY KEY, insumo_nombre TEXT, cantidad REAL, tipo TEXT, razon TEXT, fecha TIMESTAMP)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS cierres (id INTEGER PRIMARY KEY, fecha_cierre TIMESTAMP, total_turno REAL, responsable TEXT, tipo_cierre TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS reportes_pdf (id INTEGER PRIMARY KEY, fecha TIMESTAMP, nombre_archivo TEXT, pdf_data BLOB)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS gastos (id INTEGER PRIMARY KEY, razon TEXT, monto REAL, metodo_pago TEXT, fecha TIMESTAMP)''')
-    
-    # --- MIGRACIONES PARA BASES DE DATOS ANTIGUAS ---
-    try:
-        c.execute("SELECT cant_toppings FROM ventas LIMIT 1")
-    except:
-        # Si falla, agregamos las columnas nuevas
-        c.execute("ALTER TABLE ventas ADD COLUMN cant_toppings INTEGER DEFAULT 0")
-        c.execute("ALTER TABLE ventas ADD COLUMN cant_conos INTEGER DEFAULT 0")
-    
-    try:
-        c.execute("SELECT tipo_cierre FROM cierres LIMIT 1")
-    except:
-        c.execute("ALTER TABLE cierres ADD COLUMN tipo_cierre TEXT")
+# --- BASE DE DATOS (SQLite por defecto, PostgreSQL si hay DATABASE_URL) ---
+def _database_url():
+    url = os.environ.get("DATABASE_URL")
+    if url: return url
+    try: return st.secrets.get("DATABASE_URL")
+    except Exception: return None  # Sin secrets.toml
 
-    conn.commit()
-    conn.close()
+@st.cache_resource
+def get_backend():
+    # Un solo backend (y un solo pool de conexiones) para todas las sesiones
+    url = _database_url()
+    return PostgresBackend(url) if url else SQLiteBackend(DB_NAME)
+
+def init_and_migrate_db():
+    get_backend().init_schema()
 
 def run_query(query, params=(), return_data=False):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        c.execute(query, params)
-        if return_data:
-            data = c.fetchall()
-            cols = [description[0] for description in c.description]
-            conn.close()
-            return pd.DataFrame(data, columns=cols)
-        else:
-            conn.commit()
-            last_id = c.lastrowid
-            conn.close()
-            return last_id
-    except Exception as e:
-        conn.close()
-        return None
+    return get_backend().run_query(query, params, return_data)
 
 # --- FUNCIONES LÓGICAS ---
 def get_ultimo_cierre():
@@ -103,13 +72,16 @@ def get_ultimo_cierre():
         return pd.to_datetime(df.iloc[0]['fecha_cierre']).tz_convert('America/Lima')
     return None
 
+def get_rango_dia(dia):
+    # (inicio, fin) del día en hora Perú, para las consultas por periodo
+    inicio = pytz.timezone('America/Lima').localize(datetime.combine(dia, datetime.min.time()))
+    return inicio, inicio + timedelta(days=1)
+
 def cerrar_turno_db(total, responsable, tipo):
-    ahora = get_hora_peru()
-    run_query("INSERT INTO cierres (fecha_cierre, total_turno, responsable, tipo_cierre) VALUES (?,?,?,?)", (ahora, total, responsable, tipo))
+    get_backend().cerrar_turno(total, responsable, tipo, get_hora_peru())
 
 def guardar_pdf_en_bd(nombre_archivo, pdf_bytes):
-    ahora = get_hora_peru()
-    run_query("INSERT INTO reportes_pdf (fecha, nombre_archivo, pdf_data) VALUES (?,?,?)", (ahora, nombre_archivo, pdf_bytes))
+    get_backend().guardar_pdf(nombre_archivo, pdf_bytes, get_hora_peru())
 
 def log_movimiento(insumo, cantidad, tipo, razon):
     ahora = get_hora_peru()
@@ -131,106 +103,319 @@ def obtener_alertas_stock():
     return alertas_html
 
 def obtener_producto_estrella():
-    hoy = get_hora_peru().date()
-    df = run_query("SELECT * FROM ventas", return_data=True)
-    if not df.empty:
-        df['fecha'] = pd.to_datetime(df['fecha']).dt.tz_convert('America/Lima')
-        v_hoy = df[df['fecha'].dt.date == hoy]
-        if not v_hoy.empty:
-            top = v_hoy.groupby('producto_nombre')['cantidad'].sum().sort_values(ascending=False).head(1)
-            if not top.empty:
-                return top.index[0], int(top.values[0])
-    return None, 0
+    return get_backend().producto_estrella(*get_rango_dia(get_hora_peru().date()))
+
+# --- ÍNDICE DE PRODUCTOS (BÚSQUEDA RÁPIDA EN CAJA) ---
+TECLAS_RAPIDAS_N = 6
+
+def _normalizar_texto(texto):
+    # Minúsculas y sin tildes: "Limón" se encuentra escribiendo "limon"
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    return "".join(ch for ch in texto if not unicodedata.combining(ch))
+
+@st.cache_resource(show_spinner=False)
+def construir_indice_productos():
+    """
+    Índice en memoria del menú, por menu.id, compartido por todas las
+    sesiones. Se reconstruye solo tras invalidar_indice_productos().
+    """
+    df = run_query("SELECT id, nombre, precio, categoria FROM menu ORDER BY nombre, id", return_data=True)
+    productos, prefijos, por_nombre = {}, {}, {}
+    for pid, nombre, precio, categoria in df.itertuples(index=False, name=None):
+        pid = int(pid)
+        productos[pid] = {"id": pid, "nombre": nombre, "precio": float(precio or 0), "categoria": categoria or ""}
+        por_nombre.setdefault(nombre, pid)
+        for palabra in _normalizar_texto(f"{nombre} {categoria or ''}").split():
+            for i in range(1, len(palabra) + 1):
+                prefijos.setdefault(palabra[:i], set()).add(pid)
+    return {"productos": productos, "orden": list(productos), "prefijos": prefijos, "por_nombre": por_nombre}
+
+def invalidar_indice_productos():
+    # Llamar en cada escritura a menu (alta, baja, importación, restaurar BD)
+    construir_indice_productos.clear()
+
+def buscar_productos(indice, consulta):
+    # Todas las palabras deben coincidir por prefijo; si una no existe en el
+    # índice se usa la más parecida (errores de tipeo)
+    palabras = _normalizar_texto(consulta).split()
+    if not palabras: return indice['orden']
+    ids = None
+    for palabra in palabras:
+        encontrados = indice['prefijos'].get(palabra)
+        if encontrados is None:
+            parecidas = difflib.get_close_matches(palabra, indice['prefijos'].keys(), n=3, cutoff=0.75)
+            encontrados = set().union(*(indice['prefijos'][p] for p in parecidas))
+        ids = encontrados if ids is None else ids & encontrados
+    return [pid for pid in indice['orden'] if pid in ids]
+
+@st.cache_data(ttl=300, show_spinner=False)
+def obtener_mas_vendidos(limite):
+    df = run_query("SELECT producto_nombre FROM ventas GROUP BY producto_nombre ORDER BY SUM(cantidad) DESC LIMIT ?", (limite,), return_data=True)
+    return df['producto_nombre'].tolist()
+
+def obtener_teclas_fijas():
+    df = run_query("SELECT menu_id FROM teclas_rapidas ORDER BY posicion", return_data=True)
+    return [int(x) for x in df['menu_id']]
+
+def guardar_teclas_fijas(menu_ids):
+    run_query("DELETE FROM teclas_rapidas")
+    for pos, pid in enumerate(menu_ids):
+        run_query("INSERT INTO teclas_rapidas (posicion, menu_id) VALUES (?,?)", (pos, pid))
+
+def obtener_teclas_rapidas(indice, n=TECLAS_RAPIDAS_N):
+    # Productos fijados por el usuario; si no hay, los más vendidos
+    fijas = [pid for pid in obtener_teclas_fijas() if pid in indice['productos']]
+    if fijas: return fijas
+    nombres = obtener_mas_vendidos(n * 2)  # margen por productos ya borrados
+    return [indice['por_nombre'][nom] for nom in nombres if nom in indice['por_nombre']][:n]
+
+def item_carrito(prod, cantidad, n_toppings=0, n_conos=0):
+    subtotal = (prod['precio'] * cantidad) + (n_toppings * 1.0) + (n_conos * 1.0)
+    return {
+        "menu_id": prod['id'], "producto": prod['nombre'], "precio_base": prod['precio'], "cantidad": cantidad,
+        "cant_toppings": n_toppings, "cant_conos": n_conos, "extras_costo": (n_toppings+n_conos), "subtotal": subtotal
+    }
 
 # --- LÓGICA DE INVENTARIO (DESCONTAR Y RESTAURAR) ---
+def registrar_venta(carrito, metodo):
+    # Guarda la venta y DESCUENTA del inventario en una sola transacción
+    get_backend().registrar_venta(carrito, metodo, get_hora_peru())
 
-def procesar_descuento_stock(producto_nombre, cantidad_vendida, cant_conos_extra, cant_toppings):
-    # Esta función DESCUENTA del inventario al vender
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    ahora = get_hora_peru()
-    
-    # 1. Receta Base
-    c.execute("SELECT id FROM menu WHERE nombre = ?", (producto_nombre,))
-    res_prod = c.fetchone()
-    if res_prod:
-        prod_id = res_prod[0]
-        c.execute("SELECT r.insumo_id, r.cantidad_insumo, i.nombre FROM recetas r JOIN insumos i ON r.insumo_id = i.id WHERE r.menu_id = ?", (prod_id,))
-        ingredientes = c.fetchall()
-        for insumo_id, cant_receta, nom_insumo in ingredientes:
-            total_bajar = cant_receta * cantidad_vendida
-            c.execute("UPDATE insumos SET cantidad = cantidad - ? WHERE id = ?", (total_bajar, insumo_id))
-            c.execute("INSERT INTO movimientos (insumo_nombre, cantidad, tipo, razon, fecha) VALUES (?,?,?,?,?)",
-                      (nom_insumo, total_bajar, 'SALIDA', f'Venta: {producto_nombre}', ahora))
-
-    # 2. Extras
-    if cant_conos_extra > 0:
-        c.execute("SELECT id, nombre FROM insumos WHERE nombre LIKE '%Cono%' OR nombre LIKE '%Barquillo%' LIMIT 1")
-        res_cono = c.fetchone()
-        if res_cono:
-            c.execute("UPDATE insumos SET cantidad = cantidad - ? WHERE id = ?", (cant_conos_extra, res_cono[0]))
-            c.execute("INSERT INTO movimientos (insumo_nombre, cantidad, tipo, razon, fecha) VALUES (?,?,?,?,?)",
-                      (res_cono[1], cant_conos_extra, 'SALIDA', 'Venta: Cono Extra', ahora))
-
-    if cant_toppings > 0:
-        c.execute("SELECT id, nombre FROM insumos WHERE nombre LIKE '%Topping%' LIMIT 1")
-        res_top = c.fetchone()
-        if res_top:
-            c.execute("UPDATE insumos SET cantidad = cantidad - ? WHERE id = ?", (cant_toppings, res_top[0]))
-            c.execute("INSERT INTO movimientos (insumo_nombre, cantidad, tipo, razon, fecha) VALUES (?,?,?,?,?)",
-                      (res_top[1], cant_toppings, 'SALIDA', 'Venta: Topping Extra', ahora))
-
-    conn.commit()
-    conn.close()
-
-def revertir_stock_por_eliminacion(venta_id):
+def eliminar_ventas(venta_ids):
     """
-    Restaura el stock cuando se elimina una venta.
+    Elimina varias ventas y restaura su stock en una sola transacción.
     """
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    ahora = get_hora_peru()
-    
-    # 1. Obtener datos de la venta a eliminar
-    c.execute("SELECT producto_nombre, cantidad, cant_toppings, cant_conos FROM ventas WHERE id = ?", (venta_id,))
-    venta = c.fetchone()
-    
-    if venta:
-        prod_nombre, cant_vendida, c_tops, c_conos = venta
-        
-        # 2. Restaurar Receta Base
-        c.execute("SELECT id FROM menu WHERE nombre = ?", (prod_nombre,))
-        res_prod = c.fetchone()
-        if res_prod:
-            prod_id = res_prod[0]
-            c.execute("SELECT r.insumo_id, r.cantidad_insumo, i.nombre FROM recetas r JOIN insumos i ON r.insumo_id = i.id WHERE r.menu_id = ?", (prod_id,))
-            ingredientes = c.fetchall()
-            for insumo_id, cant_receta, nom_insumo in ingredientes:
-                total_subir = cant_receta * cant_vendida
-                c.execute("UPDATE insumos SET cantidad = cantidad + ? WHERE id = ?", (total_subir, insumo_id))
-                # Log en verde (Devolución)
-                c.execute("INSERT INTO movimientos (insumo_nombre, cantidad, tipo, razon, fecha) VALUES (?,?,?,?,?)",
-                          (nom_insumo, total_subir, 'DEVOLUCIÓN', f'Anulación Venta: {prod_nombre}', ahora))
-        
-        # 3. Restaurar Extras (Si existen columnas y valores)
-        if c_conos and c_conos > 0:
-            c.execute("SELECT id, nombre FROM insumos WHERE nombre LIKE '%Cono%' OR nombre LIKE '%Barquillo%' LIMIT 1")
-            res_cono = c.fetchone()
-            if res_cono:
-                c.execute("UPDATE insumos SET cantidad = cantidad + ? WHERE id = ?", (c_conos, res_cono[0]))
-                c.execute("INSERT INTO movimientos (insumo_nombre, cantidad, tipo, razon, fecha) VALUES (?,?,?,?,?)",
-                          (res_cono[1], c_conos, 'DEVOLUCIÓN', 'Anulación: Cono Extra', ahora))
-
-        if c_tops and c_tops > 0:
-            c.execute("SELECT id, nombre FROM insumos WHERE nombre LIKE '%Topping%' LIMIT 1")
-            res_top = c.fetchone()
-            if res_top:
-                c.execute("UPDATE insumos SET cantidad = cantidad + ? WHERE id = ?", (c_tops, res_top[0]))
-                c.execute("INSERT INTO movimientos (insumo_nombre, cantidad, tipo, razon, fecha) VALUES (?,?,?,?,?)",
-                          (res_top[1], c_tops, 'DEVOLUCIÓN', 'Anulación: Topping Extra', ahora))
-
-    conn.commit()
-    conn.close()
+    get_backend().eliminar_ventas(venta_ids, get_hora_peru())
+
+def eliminar_registros(tabla, ids):
+    get_backend().eliminar_registros(tabla, ids)
+    if tabla == 'menu': invalidar_indice_productos()
+
+# --- LISTAS PAGINADAS (ELIMINACIÓN MASIVA) ---
+def lista_paginada(df, key, columnas, eliminar, por_pagina=20):
+    """
+    Lista buscable y paginada con selección múltiple y borrado por lotes.
+    Dibuja un solo data_editor por página en vez de un botón por registro.
+    eliminar(ids) recibe los id seleccionados. Devuelve los id seleccionados.
+    """
+    if df.empty:
+        st.caption("Sin registros")
+        return []
+    c1, c2 = st.columns([3, 1])
+    texto = c1.text_input("🔎 Buscar", key=f"{key}_q").strip().lower()
+    por_pagina = c2.selectbox("Por página", [10, 20, 50, 100], index=[10, 20, 50, 100].index(por_pagina), key=f"{key}_pp")
+    if texto:
+        mascara = pd.Series(False, index=df.index)
+        for col in columnas:
+            mascara |= df[col].astype(str).str.lower().str.contains(texto, regex=False)
+        df = df[mascara]
+
+    total = len(df)
+    paginas = max(1, -(-total // por_pagina))
+    c3, c4 = st.columns([1, 3])
+    # La clave incluye el total de páginas: si cambia (búsqueda, borrado) vuelve a la 1
+    pagina = c3.number_input("Página", 1, paginas, 1, key=f"{key}_pag_{paginas}_{por_pagina}_{texto}")
+    todos = c4.checkbox(f"Seleccionar los {total} registros", key=f"{key}_all")
+
+    inicio = (pagina - 1) * por_pagina
+    vista = df.iloc[inicio:inicio + por_pagina][['id'] + columnas].copy()
+    vista.insert(0, "✔", todos)
+    # data_editor guarda las marcas por posición de fila: la clave lleva los
+    # id de la página para que, al cambiar los registros, no queden marcadas
+    # filas que el usuario no eligió
+    clave_ed = f"{key}_ed_{todos}_{hash(tuple(vista['id']))}"
+    # Con "Seleccionar todos" la columna ✔ queda bloqueada
+    editado = st.data_editor(vista, key=clave_ed, hide_index=True, use_container_width=True,
+                             disabled=['id'] + columnas + (["✔"] if todos else []), column_config={"id": None})
+    ids = [int(i) for i in (df['id'] if todos else editado.loc[editado["✔"], 'id'])]
+    st.caption(f"{total} registros · página {pagina} de {paginas} · {len(ids)} seleccionados")
+
+    if ids and st.button(f"🗑️ Eliminar {len(ids)} seleccionados", key=f"{key}_del"):
+        eliminar(ids)
+        for k in (clave_ed, f"{key}_all"): st.session_state.pop(k, None)
+        st.toast(f"{len(ids)} eliminados")
+        st.rerun()
+    return ids
+
+# --- IMPORTACIÓN MASIVA (CSV / EXCEL) ---
+# Filas por bloque de executemany; cada bloque va en su propio SAVEPOINT.
+IMPORT_CHUNK = 500
+
+# requeridas: columnas obligatorias del archivo
+# opcionales: columna -> valor por defecto si falta o está vacía
+# enteras: numéricas que van a columnas INTEGER
+# unicas: columna que no puede repetirse (en el archivo ni en la tabla)
+# fijas: columna -> valor que se pone a todas las filas
+# destino: columnas de la tabla en el orden del INSERT
+IMPORT_SPECS = {
+    "Menú": {
+        "tabla": "menu",
+        "requeridas": ["nombre", "precio"],
+        "opcionales": {"categoria": "Otro"},
+        "numericas": ["precio"],
+        "unicas": "nombre",
+        "destino": ["nombre", "precio", "categoria"],
+    },
+    "Insumos": {
+        "tabla": "insumos",
+        "requeridas": ["nombre", "cantidad"],
+        "opcionales": {"unidad": "", "minimo": 10.0},
+        "numericas": ["cantidad", "minimo"],
+        "unicas": "nombre",
+        "destino": ["nombre", "cantidad", "unidad", "minimo"],
+    },
+    "Recetas": {
+        # Una fila por ingrediente: un producto puede tener varias líneas
+        "tabla": "recetas",
+        "requeridas": ["producto", "insumo", "cantidad_insumo"],
+        "opcionales": {},
+        "numericas": ["cantidad_insumo"],
+        "destino": ["menu_id", "insumo_id", "cantidad_insumo"],
+    },
+    "Ventas": {
+        "tabla": "ventas",
+        "requeridas": ["producto_nombre", "cantidad", "total", "fecha"],
+        "opcionales": {"precio_base": None, "extras": 0.0, "metodo_pago": "Efectivo", "cant_toppings": 0, "cant_conos": 0},
+        "numericas": ["cantidad", "total", "precio_base", "extras", "cant_toppings", "cant_conos"],
+        "enteras": ["cantidad", "cant_toppings", "cant_conos"],
+        # Marcadas para no devolver stock al eliminarlas (nunca lo descontaron)
+        "fijas": {"origen": ORIGEN_IMPORTACION},
+        "destino": ["producto_nombre", "precio_base", "cantidad", "extras", "total", "metodo_pago", "fecha", "cant_toppings", "cant_conos", "origen"],
+    },
+    "Gastos": {
+        "tabla": "gastos",
+        "requeridas": ["razon", "monto", "fecha"],
+        "opcionales": {"metodo_pago": "Efectivo"},
+        "numericas": ["monto"],
+        "destino": ["razon", "monto", "metodo_pago", "fecha"],
+    },
+}
+
+def leer_archivo_importacion(archivo):
+    if archivo.name.lower().endswith(".xlsx"):
+        df = pd.read_excel(archivo)
+    else:
+        # Excel en español exporta con ';' y coma decimal (10,50)
+        encabezado = archivo.readline()
+        archivo.seek(0)
+        if isinstance(encabezado, bytes): encabezado = encabezado.decode("utf-8", errors="ignore")
+        if encabezado.count(";") > encabezado.count(","):
+            df = pd.read_csv(archivo, sep=";", decimal=",")
+        else:
+            df = pd.read_csv(archivo)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df
+
+def _a_hora_peru(fechas):
+    if fechas.dt.tz is None: return fechas.dt.tz_localize('America/Lima')
+    return fechas.dt.tz_convert('America/Lima')
+
+def _normalizar_fechas(serie):
+    # ISO primero (2025-01-12); lo demás como fecha peruana (12/01/2025).
+    # Fechas sin zona se asumen hora Perú; se guardan igual que get_hora_peru()
+    texto = serie.astype(str).str.strip()
+    try:
+        fechas = _a_hora_peru(pd.to_datetime(texto, errors='coerce', format='ISO8601'))
+        faltan = fechas.isna()
+        if faltan.any():
+            otras = _a_hora_peru(pd.to_datetime(texto[faltan], errors='coerce', dayfirst=True, format='mixed'))
+            fechas = fechas.astype(object).where(~faltan, otras)
+    except (AttributeError, TypeError, ValueError):
+        # Zonas horarias mezcladas: se convierte valor por valor
+        fechas = texto.map(lambda x: _a_hora_peru(pd.Series([pd.to_datetime(x, errors='coerce')])).iloc[0])
+    # Siempre con microsegundos, igual que las ventas registradas en caja:
+    # pandas no lee una columna que mezcla ambos formatos
+    return fechas.map(lambda t: None if pd.isna(t) else t.to_pydatetime().isoformat(" ", timespec="microseconds"))
+
+def validar_importacion(df, tipo):
+    """
+    Normaliza y valida un archivo de importación.
+    Devuelve (df_ok, df_rechazos); las filas malas no detienen la carga.
+    """
+    spec = IMPORT_SPECS[tipo]
+    faltan = [c for c in spec['requeridas'] if c not in df.columns]
+    if faltan:
+        raise ValueError(f"Faltan columnas: {', '.join(faltan)}")
+
+    df = df.copy()
+    df['fila'] = df.index + 2  # Número de fila como se ve en Excel (con encabezado)
+    for col, defecto in spec['opcionales'].items():
+        if col not in df.columns: df[col] = defecto
+        elif defecto is not None: df[col] = df[col].fillna(defecto)
+
+    motivo = pd.Series("", index=df.index)
+    def rechazar(mascara, texto):
+        nonlocal motivo
+        motivo = motivo.mask(mascara & (motivo == ""), texto)
+
+    for col in spec['requeridas']:
+        rechazar(df[col].isna() | (df[col].astype(str).str.strip() == ""), f"'{col}' vacío")
+    for col in spec['numericas']:
+        num = pd.to_numeric(df[col], errors='coerce')
+        rechazar(num.isna() & df[col].notna(), f"'{col}' no es número")
+        rechazar(num < 0, f"'{col}' negativo")
+        if col in spec.get('enteras', []):
+            rechazar(num.notna() & (num % 1 != 0), f"'{col}' debe ser entero")
+        df[col] = num
+    for col in ['nombre', 'categoria', 'unidad', 'producto', 'insumo', 'producto_nombre', 'metodo_pago', 'razon']:
+        if col in df.columns: df[col] = df[col].astype(str).str.strip()
+    for col, valor in spec.get('fijas', {}).items():
+        df[col] = valor
+
+    if 'unicas' in spec:
+        # La caja y el stock buscan por nombre: no puede haber dos iguales
+        col = spec['unicas']
+        existentes = run_query(f"SELECT {col} FROM {spec['tabla']}", return_data=True)[col]
+        rechazar(df[col].isin(set(existentes)), f"'{col}' ya existe")
+        rechazar(df[col].duplicated(), f"'{col}' repetido en el archivo")
+
+    if 'fecha' in df.columns:
+        df['fecha'] = _normalizar_fechas(df['fecha'])
+        rechazar(df['fecha'].isna(), "'fecha' inválida")
+        ahora = get_hora_peru()
+        rechazar(df['fecha'].map(lambda f: f is not None and datetime.fromisoformat(f) > ahora), "'fecha' en el futuro")
+
+    if tipo == "Recetas":
+        df_menu = run_query("SELECT id, nombre FROM menu", return_data=True)
+        df_ins = run_query("SELECT id, nombre FROM insumos", return_data=True)
+        # Con nombres repetidos gana el id menor, igual que en caja y stock
+        menu_por_nombre = df_menu.sort_values('id').drop_duplicates('nombre').set_index('nombre')['id']
+        ins_por_nombre = df_ins.sort_values('id').drop_duplicates('nombre').set_index('nombre')['id']
+        df['menu_id'] = df['producto'].map(menu_por_nombre)
+        df['insumo_id'] = df['insumo'].map(ins_por_nombre)
+        rechazar(df['menu_id'].isna(), "Producto no existe en el menú")
+        rechazar(df['insumo_id'].isna(), "Insumo no existe")
+        # Una línea repetida descontaría el insumo dos veces por venta
+        df_rec = run_query("SELECT menu_id, insumo_id FROM recetas", return_data=True)
+        pares = pd.Series(list(zip(df['menu_id'], df['insumo_id'])), index=df.index)
+        rechazar(pares.isin(set(zip(df_rec['menu_id'], df_rec['insumo_id']))), "La receta ya tiene ese insumo")
+        rechazar(pares.duplicated() & df['menu_id'].notna() & df['insumo_id'].notna(), "Insumo repetido en el archivo para ese producto")
+    elif tipo == "Ventas":
+        rechazar(df['cantidad'] <= 0, "'cantidad' debe ser mayor a 0")
+        # Sin precio_base se deduce del total: (total - extras) / cantidad
+        sin_precio = df['precio_base'].isna()
+        df.loc[sin_precio, 'precio_base'] = (df['total'] - df['extras']) / df['cantidad'].where(df['cantidad'] > 0)
+
+    malas = motivo != ""
+    df_rechazos = df.loc[malas, ['fila']].assign(motivo=motivo[malas])
+    return df.loc[~malas], df_rechazos
+
+def importar_masivo(tipo, df_ok, chunk=IMPORT_CHUNK):
+    """
+    Inserta las filas ya validadas (ver StorageBackend.insertar_masivo).
+    Devuelve (insertadas, df_rechazos, segundos).
+    """
+    spec = IMPORT_SPECS[tipo]
+    cols = spec['destino']
+    # astype(object) evita tipos numpy que el driver no sabe guardar
+    valores = df_ok[cols].astype(object).where(df_ok[cols].notna(), None)
+    filas = list(valores.itertuples(index=False, name=None))
+
+    inicio = time.perf_counter()
+    cargadas, rechazos = get_backend().insertar_masivo(spec['tabla'], cols, filas, df_ok['fila'].tolist(), chunk, get_hora_peru())
+    segundos = time.perf_counter() - inicio
+    if spec['tabla'] == 'menu': invalidar_indice_productos()
+    return len(cargadas), pd.DataFrame(rechazos, columns=['fila', 'motivo']), segundos
 
 # --- PDF ---
 class PDF(FPDF):
@@ -319,6 +504,7 @@ def main():
         "📉 Mermas", 
         "📝 Productos", 
         "📊 Reportes",
+        "📥 Importar",
         "💾 Respaldo"
     ])
 
@@ -340,44 +526,50 @@ def main():
         
         st.divider()
         
-        ultimo_cierre = get_ultimo_cierre()
-        df_todas = run_query("SELECT * FROM ventas", return_data=True)
-        total_turno_actual = 0.0
-        
-        if not df_todas.empty:
-            df_todas['fecha'] = pd.to_datetime(df_todas['fecha']).dt.tz_convert('America/Lima')
-            if ultimo_cierre:
-                df_turno = df_todas[df_todas['fecha'] > ultimo_cierre]
-            else:
-                df_turno = df_todas
-            total_turno_actual = df_turno['total'].sum()
+        total_turno_actual = get_backend().total_ventas(desde=get_ultimo_cierre())
         
         st.metric("💰 Dinero en Caja (Corte Actual)", f"S/ {total_turno_actual:,.2f}")
         
         st.subheader("Nueva Venta")
-        df_menu = run_query("SELECT * FROM menu ORDER BY nombre", return_data=True)
-        if not df_menu.empty:
-            c1, c2, c3 = st.columns([3, 1, 1])
-            opciones = [f"{row['nombre']} | S/{row['precio']}" for i, row in df_menu.iterrows()]
-            seleccion = c1.selectbox("Producto", opciones)
-            cantidad = c2.number_input("Cantidad", 1, 50, 1)
-            
-            nombre_prod = seleccion.split(" | S/")[0]
-            precio_base = float(seleccion.split(" | S/")[1])
-            
-            cx1, cx2 = st.columns(2)
-            n_toppings = cx1.number_input("¿Cuántos con Topping?", 0, cantidad * 5, 0)
-            n_conos = cx2.number_input("¿Cuántos con Cono Extra?", 0, cantidad * 5, 0)
-            
-            subtotal = (precio_base * cantidad) + (n_toppings * 1.0) + (n_conos * 1.0)
-            c3.metric("Subtotal", f"S/ {subtotal:.2f}")
-            
-            if st.button("➕ Agregar al Carrito"):
-                st.session_state.carrito.append({
-                    "producto": nombre_prod, "precio_base": precio_base, "cantidad": cantidad,
-                    "cant_toppings": n_toppings, "cant_conos": n_conos, "extras_costo": (n_toppings+n_conos), "subtotal": subtotal
-                })
-                st.toast("Agregado")
+        indice = construir_indice_productos()
+        productos = indice['productos']
+        if productos:
+            # Teclas rápidas: un toque agrega 1 unidad sin extras
+            teclas = obtener_teclas_rapidas(indice)
+            if teclas:
+                cols_t = st.columns(min(len(teclas), TECLAS_RAPIDAS_N))
+                for n, pid in enumerate(teclas):
+                    prod = productos[pid]
+                    if cols_t[n % len(cols_t)].button(f"{prod['nombre']} · S/{prod['precio']:.2f}", key=f"qk_{pid}", use_container_width=True):
+                        st.session_state.carrito.append(item_carrito(prod, 1))
+                        st.toast(f"Agregado: {prod['nombre']}")
+            with st.expander("⚙️ Teclas Rápidas"):
+                fijas = st.multiselect("Productos fijos (vacío = más vendidos)", indice['orden'],
+                                       default=[pid for pid in obtener_teclas_fijas() if pid in productos],
+                                       format_func=lambda pid: productos[pid]['nombre'])
+                if st.button("Guardar Teclas"):
+                    guardar_teclas_fijas(fijas)
+                    st.rerun()
+
+            busqueda = st.text_input("🔎 Buscar", placeholder="Nombre o categoría")
+            resultados = buscar_productos(indice, busqueda)
+            if not resultados:
+                st.info("Sin resultados")
+            else:
+                c1, c2, c3 = st.columns([3, 1, 1])
+                pid = c1.selectbox("Producto", resultados, format_func=lambda pid: f"{productos[pid]['nombre']} | S/{productos[pid]['precio']:.2f}")
+                cantidad = c2.number_input("Cantidad", 1, 50, 1)
+                
+                cx1, cx2 = st.columns(2)
+                n_toppings = cx1.number_input("¿Cuántos con Topping?", 0, cantidad * 5, 0)
+                n_conos = cx2.number_input("¿Cuántos con Cono Extra?", 0, cantidad * 5, 0)
+                
+                item = item_carrito(productos[pid], cantidad, n_toppings, n_conos)
+                c3.metric("Subtotal", f"S/ {item['subtotal']:.2f}")
+                
+                if st.button("➕ Agregar al Carrito"):
+                    st.session_state.carrito.append(item)
+                    st.toast("Agregado")
 
         st.divider()
         if len(st.session_state.carrito) > 0:
@@ -392,19 +584,17 @@ def main():
             with c_pay:
                 metodo = st.radio("Pago", ["Efectivo", "Yape", "Tarjeta"], horizontal=True)
                 if st.button("✅ COBRAR", type="primary", use_container_width=True):
-                    hora = get_hora_peru()
-                    for item in st.session_state.carrito:
-                        # GUARDAR VENTA CON LOS DETALLES DE EXTRAS PARA PODER RESTAURAR DESPUÉS
-                        run_query("""INSERT INTO ventas 
-                                     (producto_nombre, precio_base, cantidad, extras, total, metodo_pago, fecha, cant_toppings, cant_conos) 
-                                     VALUES (?,?,?,?,?,?,?,?,?)""",
-                                  (item['producto'], item['precio_base'], item['cantidad'], item['extras_costo'], item['subtotal'], metodo, hora, item['cant_toppings'], item['cant_conos']))
-                        
-                        procesar_descuento_stock(item['producto'], item['cantidad'], item['cant_conos'], item['cant_toppings'])
-                    
-                    st.session_state.carrito = []
-                    st.success("Venta registrada")
-                    st.rerun()
+                    # GUARDA LOS DETALLES DE EXTRAS PARA PODER RESTAURAR DESPUÉS
+                    try:
+                        registrar_venta(st.session_state.carrito, metodo)
+                    except Exception:
+                        # La transacción se deshizo entera: el carrito sigue igual
+                        st.error("No se pudo registrar la venta (caja ocupada). Intenta cobrar de nuevo.")
+                    else:
+                        st.session_state.carrito = []
+                        obtener_mas_vendidos.clear()
+                        st.success("Venta registrada")
+                        st.rerun()
             
             if st.button("Vaciar Lista"):
                 st.session_state.carrito = []
@@ -436,12 +626,7 @@ def main():
             df_g['fecha'] = pd.to_datetime(df_g['fecha']).dt.tz_convert('America/Lima')
             st.dataframe(df_g, use_container_width=True)
             with st.expander("Eliminar Gasto"):
-                for i, r in df_g.iterrows():
-                    c1, c2 = st.columns([4,1])
-                    c1.write(f"{r['razon']} - S/{r['monto']}")
-                    if c2.button("❌", key=f"dg_{r['id']}"):
-                        run_query("DELETE FROM gastos WHERE id=?", (r['id'],))
-                        st.rerun()
+                lista_paginada(df_g, "dg", ['fecha', 'razon', 'monto', 'metodo_pago'], lambda ids: eliminar_registros('gastos', ids))
 
     # -----------------------------------------------------------
     # 2. CIERRE DE CAJA
@@ -454,21 +639,9 @@ def main():
         ultimo_cierre = get_ultimo_cierre()
         
         # VENTAS Y GASTOS DEL TURNO
-        df_todas = run_query("SELECT * FROM ventas", return_data=True)
-        df_g_all = run_query("SELECT * FROM gastos", return_data=True)
-        df_turno = pd.DataFrame()
-        total_ventas = 0.0
-        total_gastos = 0.0
-        
-        if not df_todas.empty:
-            df_todas['fecha'] = pd.to_datetime(df_todas['fecha']).dt.tz_convert('America/Lima')
-            df_turno = df_todas[df_todas['fecha'] > ultimo_cierre] if ultimo_cierre else df_todas
-            total_ventas = df_turno['total'].sum()
-            
-        if not df_g_all.empty:
-            df_g_all['fecha'] = pd.to_datetime(df_g_all['fecha']).dt.tz_convert('America/Lima')
-            g_turno = df_g_all[df_g_all['fecha'] > ultimo_cierre] if ultimo_cierre else df_g_all
-            total_gastos = g_turno['monto'].sum()
+        df_turno = get_backend().ventas_periodo(desde=ultimo_cierre).iloc[::-1]  # En orden de venta para el PDF
+        total_ventas = df_turno['total'].sum() if not df_turno.empty else 0.0
+        total_gastos = get_backend().total_gastos(desde=ultimo_cierre)
         
         col_info, col_action = st.columns([2, 1])
         
@@ -508,15 +681,7 @@ def main():
         
         if not df_turno.empty:
             with st.expander("📝 Eliminar Ventas del Turno (Devuelve Stock)"):
-                for i, row in df_turno.iterrows():
-                    c1, c2, c3 = st.columns([4, 2, 1])
-                    c1.write(f"{row['producto_nombre']} ({row['cantidad']})")
-                    c2.write(f"S/ {row['total']}")
-                    if c3.button("❌", key=f"dvt_{row['id']}"):
-                        revertir_stock_por_eliminacion(row['id']) # <--- RESTAURA STOCK
-                        run_query("DELETE FROM ventas WHERE id=?", (row['id'],))
-                        st.success("Venta eliminada y stock restaurado.")
-                        st.rerun()
+                lista_paginada(df_turno, "dvt", ['fecha', 'producto_nombre', 'cantidad', 'total', 'metodo_pago'], eliminar_ventas) # <--- RESTAURA STOCK
 
     # -----------------------------------------------------------
     # 3. INVENTARIO
@@ -614,20 +779,13 @@ def main():
                         qg = st.number_input("Cant", 0.1)
                 if st.form_submit_button("Guardar"):
                     pid = run_query("INSERT INTO menu (nombre, precio, categoria) VALUES (?,?,?)", (n, p, cat))
+                    invalidar_indice_productos()
                     if vinc and iid:
                         run_query("INSERT INTO recetas (menu_id, insumo_id, cantidad_insumo) VALUES (?,?,?)", (pid, iid, qg))
                     st.success("Ok")
                     st.rerun()
-        df_m = run_query("SELECT * FROM menu", return_data=True)
-        if not df_m.empty:
-            for i,r in df_m.iterrows():
-                c1,c2,c3 = st.columns([3,1,1])
-                c1.write(r['nombre'])
-                c2.write(r['precio'])
-                if c3.button("🗑️", key=f"dp{r['id']}"):
-                    run_query("DELETE FROM menu WHERE id=?", (r['id'],))
-                    run_query("DELETE FROM recetas WHERE menu_id=?", (r['id'],))
-                    st.rerun()
+        df_m = run_query("SELECT * FROM menu ORDER BY nombre", return_data=True)
+        lista_paginada(df_m, "dp", ['nombre', 'precio', 'categoria'], lambda ids: eliminar_registros('menu', ids))
 
     # -----------------------------------------------------------
     # 6. REPORTES
@@ -640,27 +798,19 @@ def main():
         
         with tab_dia:
             st.write(f"Total Día: **{hoy}**")
-            df_v = run_query("SELECT * FROM ventas ORDER BY id DESC", return_data=True)
-            df_g = run_query("SELECT * FROM gastos", return_data=True)
-            
-            v_hoy = pd.DataFrame()
-            tot_v, tot_g = 0.0, 0.0
+            desde, hasta = get_rango_dia(hoy)
+            v_hoy = get_backend().ventas_periodo(desde, hasta)
+            tot_g = get_backend().total_gastos(desde, hasta)
+            tot_v = 0.0
             tot_efectivo, tot_yape = 0.0, 0.0
             
-            if not df_v.empty:
-                df_v['fecha'] = pd.to_datetime(df_v['fecha']).dt.tz_convert('America/Lima')
-                v_hoy = df_v[df_v['fecha'].dt.date == hoy]
+            if not v_hoy.empty:
                 tot_v = v_hoy['total'].sum()
                 # Calculo desglose
                 for _, r in v_hoy.iterrows():
                     if "Efectivo" in r['metodo_pago']: tot_efectivo += r['total']
                     else: tot_yape += r['total']
             
-            if not df_g.empty:
-                df_g['fecha'] = pd.to_datetime(df_g['fecha']).dt.tz_convert('America/Lima')
-                g_hoy = df_g[df_g['fecha'].dt.date == hoy]
-                tot_g = g_hoy['monto'].sum()
-            
             c1, c2, c3 = st.columns(3)
             c1.metric("Venta Bruta", f"S/ {tot_v:,.2f}")
             c2.metric("Gastos", f"S/ {tot_g:,.2f}")
@@ -683,14 +833,7 @@ def main():
                 c2.download_button("Excel", buff.getvalue(), f"Dia_{hoy}.xlsx")
                 
                 with st.expander("Eliminar Ventas Históricas (Devuelve Stock)"):
-                    for i, r in v_hoy.iterrows():
-                        cols = st.columns([2, 2, 1])
-                        cols[0].write(r['producto_nombre'])
-                        cols[1].write(f"S/ {r['total']}")
-                        if cols[2].button("❌", key=f"del_h_{r['id']}"):
-                            revertir_stock_por_eliminacion(r['id'])
-                            run_query("DELETE FROM ventas WHERE id=?", (r['id'],))
-                            st.rerun()
+                    lista_paginada(v_hoy, "del_h", ['fecha', 'producto_nombre', 'cantidad', 'total', 'metodo_pago'], eliminar_ventas)
         
         with tab_cierres:
             df_c = run_query("SELECT * FROM cierres ORDER BY id DESC", return_data=True)
@@ -699,21 +842,70 @@ def main():
                 st.dataframe(df_c, use_container_width=True)
 
         with tab_pdfs:
-            df_p = run_query("SELECT id, fecha, nombre_archivo, pdf_data FROM reportes_pdf ORDER BY id DESC", return_data=True)
-            if not df_p.empty:
-                for i, r in df_p.iterrows():
-                    c1, c2, c3 = st.columns([3, 1, 1])
-                    c1.write(r['nombre_archivo'])
-                    c2.download_button("⬇️", r['pdf_data'], r['nombre_archivo'])
-                    if c3.button("🗑️", key=f"dpdf_{r['id']}"):
-                        run_query("DELETE FROM reportes_pdf WHERE id=?", (r['id'],))
-                        st.rerun()
+            # Sin pdf_data: el PDF se lee solo al descargarlo
+            df_p = run_query("SELECT id, fecha, nombre_archivo FROM reportes_pdf ORDER BY id DESC", return_data=True)
+            sel = lista_paginada(df_p, "dpdf", ['fecha', 'nombre_archivo'], lambda ids: eliminar_registros('reportes_pdf', ids))
+            if len(sel) == 1:
+                df_pdf = run_query("SELECT nombre_archivo, pdf_data FROM reportes_pdf WHERE id=?", (sel[0],), return_data=True)
+                if not df_pdf.empty:
+                    st.download_button(f"⬇️ {df_pdf.iloc[0]['nombre_archivo']}", df_pdf.iloc[0]['pdf_data'], df_pdf.iloc[0]['nombre_archivo'])
+            elif sel:
+                st.caption("Selecciona un solo reporte para descargarlo.")
+
+    # -----------------------------------------------------------
+    # 7. IMPORTACIÓN MASIVA
+    # -----------------------------------------------------------
+    elif opcion == "📥 Importar":
+        st.header("Importación Masiva")
+        st.markdown("""<div class="respaldo-box">Carga menú, insumos, recetas, ventas o gastos desde CSV/Excel. Las filas con errores se omiten sin detener la carga. Las ventas históricas <b>no</b> descuentan stock ni lo devuelven al eliminarlas. No se aceptan fechas futuras. Tras importar ventas o gastos se registra un cierre en la última fecha cargada (o antes de la primera venta o gasto del turno actual).</div>""", unsafe_allow_html=True)
+        st.divider()
+        tipo = st.selectbox("Tipo de datos", list(IMPORT_SPECS.keys()))
+        spec = IMPORT_SPECS[tipo]
+        plantilla = pd.DataFrame(columns=spec['requeridas'] + list(spec['opcionales'].keys()))
+        st.caption(f"Obligatorias: {', '.join(spec['requeridas'])} | Opcionales: {', '.join(spec['opcionales'].keys()) or '-'}")
+        st.download_button("⬇️ Plantilla CSV", plantilla.to_csv(index=False), f"plantilla_{spec['tabla']}.csv", "text/csv")
+
+        # Tras importar se cambia la key del uploader: el archivo se quita
+        # y un segundo clic no vuelve a cargar lo mismo
+        if 'imp_n' not in st.session_state: st.session_state.imp_n = 0
+        resultado = st.session_state.pop('imp_resultado', None)
+        if resultado:
+            insertadas, df_bad, seg = resultado
+            st.success(f"{insertadas} filas en {seg:.2f} s ({insertadas / max(seg, 1e-6):,.0f} filas/s)")
+        else:
+            df_bad = pd.DataFrame()
+
+        up = st.file_uploader("Archivo", type=["csv", "xlsx"], key=f"imp_up_{st.session_state.imp_n}")
+        if up:
+            try:
+                df_imp = leer_archivo_importacion(up)
+                df_ok, df_bad = validar_importacion(df_imp, tipo)
+            except Exception as e:
+                st.error(f"No se pudo leer el archivo: {e}")
+            else:
+                c1, c2 = st.columns(2)
+                c1.metric("Filas válidas", len(df_ok))
+                c2.metric("Filas rechazadas", len(df_bad))
+                st.dataframe(df_imp.head(20), use_container_width=True)
+                if st.button("📥 Importar", type="primary", disabled=df_ok.empty):
+                    insertadas, df_err, seg = importar_masivo(tipo, df_ok)
+                    df_bad = pd.concat([df_bad, df_err], ignore_index=True).sort_values('fila')
+                    st.session_state.imp_resultado = (insertadas, df_bad, seg)
+                    st.session_state.imp_n += 1
+                    st.rerun()
+        if not df_bad.empty:
+            st.warning(f"{len(df_bad)} filas rechazadas")
+            st.dataframe(df_bad, use_container_width=True)
+            st.download_button("⬇️ Rechazos", df_bad.to_csv(index=False), "rechazos.csv", "text/csv")
 
     # -----------------------------------------------------------
-    # 7. RESPALDO
+    # 8. RESPALDO
     # -----------------------------------------------------------
     elif opcion == "💾 Respaldo":
         st.header("Respaldo")
+        if get_backend().ARCHIVO is None:
+            st.info("Los datos están en PostgreSQL: el respaldo se hace con pg_dump en el servidor.")
+            return
         c1, c2 = st.columns(2)
         with c1:
             if st.button("⬇️ Descargar BD"):
@@ -725,6 +917,7 @@ def main():
             up = st.file_uploader("Subir .db", type="db")
             if up and st.button("Restaurar"):
                 with open(DB_NAME, "wb") as f: f.write(up.getbuffer())
+                invalidar_indice_productos()
                 st.success("Restaurado")
                 st.rerun()
 
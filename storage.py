@@ -0,0 +1,559 @@
+"""
+Backends de almacenamiento del sistema de heladería.
+
+app.py no abre conexiones: todo pasa por un StorageBackend.
+- SQLiteBackend: archivo local (modo por defecto, igual que antes).
+- PostgresBackend: pool de conexiones, sentencias preparadas y
+  agregaciones (totales, producto estrella) calculadas en el servidor.
+
+Las consultas de app.py usan '?' como marcador; cada backend las
+traduce a su formato.
+"""
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import pandas as pd
+
+ZONA = 'America/Lima'
+
+# Lotes para "WHERE id IN (...)": por debajo del límite de parámetros de SQLite
+LOTE_IDS = 500
+
+# ventas.origen de las ventas cargadas desde un archivo: nunca descontaron stock
+ORIGEN_IMPORTACION = 'IMPORTACION'
+
+
+def _lotes(ids):
+    for i in range(0, len(ids), LOTE_IDS):
+        lote = list(ids[i:i + LOTE_IDS])
+        yield lote, ",".join("?" * len(lote))
+
+
+def _a_datetime(v):
+    # SQLite devuelve las fechas como texto; PostgreSQL como datetime
+    return datetime.fromisoformat(v) if isinstance(v, str) else v
+
+
+def _valor(v):
+    # Escalares numpy (p. ej. un id leído con iterrows) -> tipos de Python
+    if hasattr(v, 'item') and not isinstance(v, (bytes, bytearray, memoryview)):
+        return v.item()
+    return v
+
+
+class StorageBackend(ABC):
+    """
+    Operaciones de base de datos que usa app.py. Las subclases definen
+    la conexión, el esquema y la traducción de SQL; la lógica de stock,
+    cierres e importación es común.
+    """
+    Error = Exception
+    LIKE = "LIKE"        # Búsqueda de insumos extra sin distinguir mayúsculas
+    ARCHIVO = None       # Ruta del archivo de la BD si el backend tiene uno
+
+    # --- Métodos que define cada backend ---
+    @abstractmethod
+    def init_schema(self):
+        ...
+
+    @abstractmethod
+    @contextmanager
+    def _conexion(self):
+        # Una transacción: commit al salir, rollback si hay error
+        ...
+
+    def _sql(self, query):
+        return query
+
+    def _ultimo_id(self, c):
+        return c.lastrowid
+
+    def _diferir_indices(self, c, tabla):
+        return []
+
+    def _restaurar_indices(self, c, tabla, diferidos):
+        pass
+
+    # --- Consultas genéricas ---
+    def _exec(self, c, query, params=()):
+        c.execute(self._sql(query), [_valor(v) for v in params])
+
+    def _execmany(self, c, query, filas):
+        filas = [[_valor(v) for v in f] for f in filas]
+        if filas:
+            c.executemany(self._sql(query), filas)
+
+    def _sql_insert(self, query):
+        return query
+
+    def run_query(self, query, params=(), return_data=False):
+        try:
+            with self._conexion() as conn:
+                c = conn.cursor()
+                if return_data:
+                    self._exec(c, query, params)
+                    cols = [description[0] for description in c.description]
+                    return pd.DataFrame(c.fetchall(), columns=cols)
+                self._exec(c, self._sql_insert(query), params)
+                return self._ultimo_id(c)
+        except Exception:
+            return None
+
+    # --- Ventas y stock ---
+    def _insumos_extra(self, c):
+        # (id, nombre) del insumo de conos y del de toppings, o None
+        self._exec(c, f"SELECT id, nombre FROM insumos WHERE nombre {self.LIKE} '%Cono%' OR nombre {self.LIKE} '%Barquillo%' ORDER BY id LIMIT 1")
+        res_cono = c.fetchone()
+        self._exec(c, f"SELECT id, nombre FROM insumos WHERE nombre {self.LIKE} '%Topping%' ORDER BY id LIMIT 1")
+        res_top = c.fetchone()
+        return res_cono, res_top
+
+    def _descontar_stock(self, c, carrito, ahora):
+        # Suma lo que baja cada insumo en todo el carrito y aplica un UPDATE
+        # por insumo en orden de id: dos cajas que cobran a la vez bloquean
+        # las filas en el mismo orden y no se interbloquean (PostgreSQL)
+        # 1. Receta Base (por id si viene del carrito, si no por nombre)
+        ids_items = []
+        for item in carrito:
+            menu_id = item.get('menu_id')
+            if menu_id is None:
+                self._exec(c, "SELECT id FROM menu WHERE nombre = ?", (item['producto'],))
+                res_prod = c.fetchone()
+                menu_id = res_prod[0] if res_prod else None
+            ids_items.append(menu_id)
+        recetas = {}
+        for lote, marcas in _lotes(sorted({m for m in ids_items if m is not None})):
+            self._exec(c, f"SELECT r.menu_id, r.insumo_id, r.cantidad_insumo, i.nombre FROM recetas r JOIN insumos i ON r.insumo_id = i.id WHERE r.menu_id IN ({marcas}) ORDER BY r.id", lote)
+            for menu_id, insumo_id, cant_receta, nom_insumo in c.fetchall():
+                recetas.setdefault(menu_id, []).append((insumo_id, cant_receta, nom_insumo))
+        con_extras = any(item['cant_conos'] > 0 or item['cant_toppings'] > 0 for item in carrito)
+        res_cono, res_top = self._insumos_extra(c) if con_extras else (None, None)
+
+        bajar = {}  # insumo_id -> cantidad a descontar
+        movimientos = []
+        for item, menu_id in zip(carrito, ids_items):
+            producto_nombre, cantidad_vendida = item['producto'], item['cantidad']
+            for insumo_id, cant_receta, nom_insumo in recetas.get(menu_id, []):
+                total_bajar = cant_receta * cantidad_vendida
+                bajar[insumo_id] = bajar.get(insumo_id, 0) + total_bajar
+                movimientos.append((nom_insumo, total_bajar, 'SALIDA', f'Venta: {producto_nombre}', ahora))
+
+            # 2. Extras
+            for cant, res, etiqueta in [(item['cant_conos'], res_cono, "Cono Extra"), (item['cant_toppings'], res_top, "Topping Extra")]:
+                if cant > 0 and res:
+                    bajar[res[0]] = bajar.get(res[0], 0) + cant
+                    movimientos.append((res[1], cant, 'SALIDA', f'Venta: {etiqueta}', ahora))
+
+        self._execmany(c, "UPDATE insumos SET cantidad = cantidad - ? WHERE id = ?", [(bajar[iid], iid) for iid in sorted(bajar)])
+        self._execmany(c, "INSERT INTO movimientos (insumo_nombre, cantidad, tipo, razon, fecha) VALUES (?,?,?,?,?)", movimientos)
+
+    def registrar_venta(self, carrito, metodo, ahora):
+        """
+        Guarda todas las líneas del carrito y descuenta su stock en una
+        sola transacción.
+        """
+        with self._conexion() as conn:
+            c = conn.cursor()
+            for item in carrito:
+                # Se guardan los extras para poder restaurarlos al anular
+                self._exec(c, """INSERT INTO ventas
+                                 (producto_nombre, precio_base, cantidad, extras, total, metodo_pago, fecha, cant_toppings, cant_conos, menu_id)
+                                 VALUES (?,?,?,?,?,?,?,?,?,?)""",
+                           (item['producto'], item['precio_base'], item['cantidad'], item['extras_costo'], item['subtotal'],
+                            metodo, ahora, item['cant_toppings'], item['cant_conos'], item.get('menu_id')))
+            self._descontar_stock(c, carrito, ahora)
+
+    def _revertir_stock_ventas(self, c, venta_ids, ahora):
+        # Devuelve al inventario lo descontado por varias ventas, con una sola
+        # consulta de recetas y un UPDATE por insumo (no uno por venta)
+        ventas = []
+        for lote, marcas in _lotes(venta_ids):
+            self._exec(c, f"""SELECT producto_nombre, cantidad, cant_toppings, cant_conos,
+                                     COALESCE(menu_id, (SELECT MIN(id) FROM menu WHERE nombre = ventas.producto_nombre))
+                              FROM ventas WHERE id IN ({marcas}) AND (origen IS NULL OR origen <> ?)""", lote + [ORIGEN_IMPORTACION])
+            ventas += c.fetchall()
+        if not ventas:
+            return
+
+        recetas = {}
+        menu_ids = sorted({v[4] for v in ventas if v[4] is not None})
+        for lote, marcas in _lotes(menu_ids):
+            self._exec(c, f"SELECT r.menu_id, r.insumo_id, r.cantidad_insumo, i.nombre FROM recetas r JOIN insumos i ON r.insumo_id = i.id WHERE r.menu_id IN ({marcas})", lote)
+            for menu_id, insumo_id, cant_receta, nom_insumo in c.fetchall():
+                recetas.setdefault(menu_id, []).append((insumo_id, cant_receta, nom_insumo))
+        res_cono, res_top = self._insumos_extra(c)
+
+        subir = {}  # insumo_id -> cantidad a devolver
+        movimientos = []
+        for prod_nombre, cant_vendida, c_tops, c_conos, prod_id in ventas:
+            # 1. Receta Base
+            for insumo_id, cant_receta, nom_insumo in recetas.get(prod_id, []):
+                total_subir = cant_receta * cant_vendida
+                subir[insumo_id] = subir.get(insumo_id, 0) + total_subir
+                # Log en verde (Devolución)
+                movimientos.append((nom_insumo, total_subir, 'DEVOLUCIÓN', f'Anulación Venta: {prod_nombre}', ahora))
+
+            # 2. Extras (Si existen columnas y valores)
+            if c_conos and c_conos > 0 and res_cono:
+                subir[res_cono[0]] = subir.get(res_cono[0], 0) + c_conos
+                movimientos.append((res_cono[1], c_conos, 'DEVOLUCIÓN', 'Anulación: Cono Extra', ahora))
+            if c_tops and c_tops > 0 and res_top:
+                subir[res_top[0]] = subir.get(res_top[0], 0) + c_tops
+                movimientos.append((res_top[1], c_tops, 'DEVOLUCIÓN', 'Anulación: Topping Extra', ahora))
+
+        self._execmany(c, "UPDATE insumos SET cantidad = cantidad + ? WHERE id = ?", [(subir[iid], iid) for iid in sorted(subir)])
+        self._execmany(c, "INSERT INTO movimientos (insumo_nombre, cantidad, tipo, razon, fecha) VALUES (?,?,?,?,?)", movimientos)
+
+    def eliminar_ventas(self, venta_ids, ahora):
+        """
+        Elimina varias ventas y restaura su stock en una sola transacción.
+        """
+        with self._conexion() as conn:
+            c = conn.cursor()
+            self._revertir_stock_ventas(c, venta_ids, ahora)
+            for lote, marcas in _lotes(venta_ids):
+                self._exec(c, f"DELETE FROM ventas WHERE id IN ({marcas})", lote)
+
+    def eliminar_registros(self, tabla, ids):
+        # Borrado por lotes; al borrar productos también se van sus recetas y teclas rápidas
+        hijos = [('recetas', 'menu_id'), ('teclas_rapidas', 'menu_id')] if tabla == 'menu' else []
+        with self._conexion() as conn:
+            c = conn.cursor()
+            for lote, marcas in _lotes(ids):
+                self._exec(c, f"DELETE FROM {tabla} WHERE id IN ({marcas})", lote)
+                for hijo, columna in hijos:
+                    self._exec(c, f"DELETE FROM {hijo} WHERE {columna} IN ({marcas})", lote)
+
+    # --- Cierres y reportes ---
+    def cerrar_turno(self, total, responsable, tipo, ahora):
+        with self._conexion() as conn:
+            self._exec(conn.cursor(), "INSERT INTO cierres (fecha_cierre, total_turno, responsable, tipo_cierre) VALUES (?,?,?,?)",
+                       (ahora, total, responsable, tipo))
+
+    def guardar_pdf(self, nombre_archivo, pdf_bytes, ahora):
+        with self._conexion() as conn:
+            self._exec(conn.cursor(), "INSERT INTO reportes_pdf (fecha, nombre_archivo, pdf_data) VALUES (?,?,?)",
+                       (ahora, nombre_archivo, pdf_bytes))
+
+    # --- Agregaciones por periodo (desde exclusivo, hasta exclusivo) ---
+    # Versión base: se filtra en pandas, como hacía app.py con SQLite.
+    def _periodo(self, tabla, desde, hasta):
+        df = self.run_query(f"SELECT * FROM {tabla} ORDER BY id DESC", return_data=True)
+        if df.empty:
+            return df
+        df['fecha'] = pd.to_datetime(df['fecha'], utc=True, format='ISO8601').dt.tz_convert(ZONA)
+        if desde is not None: df = df[df['fecha'] > desde]
+        if hasta is not None: df = df[df['fecha'] < hasta]
+        return df
+
+    def ventas_periodo(self, desde=None, hasta=None):
+        return self._periodo('ventas', desde, hasta)
+
+    def total_ventas(self, desde=None, hasta=None):
+        df = self.ventas_periodo(desde, hasta)
+        return float(df['total'].sum()) if not df.empty else 0.0
+
+    def total_gastos(self, desde=None, hasta=None):
+        df = self._periodo('gastos', desde, hasta)
+        return float(df['monto'].sum()) if not df.empty else 0.0
+
+    def producto_estrella(self, desde=None, hasta=None):
+        df = self.ventas_periodo(desde, hasta)
+        if df.empty:
+            return None, 0
+        top = df.groupby('producto_nombre')['cantidad'].sum().sort_values(ascending=False).head(1)
+        return top.index[0], int(top.values[0])
+
+    # --- Importación masiva ---
+    @contextmanager
+    def _conexion_masiva(self):
+        with self._conexion() as conn:
+            yield conn
+
+    def insertar_masivo(self, tabla, columnas, filas, nums_fila, chunk, ahora):
+        """
+        Inserta filas por bloques (executemany) en una sola transacción.
+        Los índices y triggers de la tabla se retiran durante la carga y
+        se recrean al final. Si un bloque falla, se reintenta fila por
+        fila y solo se rechazan las filas con error.
+        Devuelve (cargadas, rechazos) con rechazos = [{'fila', 'motivo'}].
+        """
+        sql = f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({','.join('?' * len(columnas))})"
+        rechazos, cargadas = [], []
+        with self._conexion_masiva() as conn:
+            c = conn.cursor()
+            if tabla in ('ventas', 'gastos'):
+                previo, primero_caja = self._primer_registro_de_caja(c)
+            diferidos = self._diferir_indices(c, tabla)
+            for i in range(0, len(filas), chunk):
+                bloque, nums = filas[i:i + chunk], nums_fila[i:i + chunk]
+                c.execute("SAVEPOINT bloque")
+                try:
+                    self._execmany(c, sql, bloque)
+                    cargadas.extend(bloque)
+                except self.Error:
+                    c.execute("ROLLBACK TO SAVEPOINT bloque")
+                    for fila, n in zip(bloque, nums):
+                        c.execute("SAVEPOINT fila")
+                        try:
+                            self._exec(c, sql, fila)
+                            cargadas.append(fila)
+                        except self.Error as e:
+                            c.execute("ROLLBACK TO SAVEPOINT fila")
+                            rechazos.append({'fila': n, 'motivo': str(e).strip()})
+                        c.execute("RELEASE SAVEPOINT fila")
+                c.execute("RELEASE SAVEPOINT bloque")
+
+            if tabla == 'insumos':
+                # Mismo registro en Kardex que al crear un insumo a mano
+                self._execmany(c, "INSERT INTO movimientos (insumo_nombre, cantidad, tipo, razon, fecha) VALUES (?,?,?,?,?)",
+                               [(f[0], f[1], 'ENTRADA', 'Importación', ahora) for f in cargadas])
+            if tabla in ('ventas', 'gastos') and cargadas:
+                self._cierre_importacion(c, tabla, columnas, cargadas, previo, primero_caja)
+            self._restaurar_indices(c, tabla, diferidos)
+        return cargadas, rechazos
+
+    def _primer_registro_de_caja(self, c):
+        # Fecha de la primera venta de caja o gasto posterior al último cierre
+        # (None si no hay). Se consulta antes de insertar lo importado.
+        self._exec(c, "SELECT fecha_cierre FROM cierres ORDER BY id DESC LIMIT 1")
+        previo = c.fetchone()
+        previo = _a_datetime(previo[0]) if previo else None
+        self._exec(c, "SELECT fecha FROM ventas WHERE origen IS NULL OR origen <> ?", (ORIGEN_IMPORTACION,))
+        fechas = [_a_datetime(f[0]) for f in c.fetchall()]
+        self._exec(c, "SELECT fecha FROM gastos")
+        fechas += [_a_datetime(f[0]) for f in c.fetchall()]
+        posteriores = [f for f in fechas if f is not None and (previo is None or f > previo)]
+        return previo, min(posteriores, default=None)
+
+    def _cierre_importacion(self, c, tabla, columnas, cargadas, previo, primero_caja):
+        # Un cierre en la última fecha importada: así el historial no cuenta
+        # como turno actual (Dinero en Caja, Cierre de Caja). Si ya hay ventas
+        # o gastos de caja en el turno, el cierre va justo antes del primero
+        # para no sacarlos del turno.
+        i_fecha = columnas.index('fecha')
+        cierre = max(_a_datetime(f[i_fecha]) for f in cargadas)
+        if primero_caja is not None:
+            cierre = min(cierre, primero_caja - timedelta(microseconds=1))
+        if previo is not None and previo >= cierre:
+            return
+        incluidas = [f for f in cargadas if _a_datetime(f[i_fecha]) <= cierre]
+        total = sum(f[columnas.index('total')] for f in incluidas) if tabla == 'ventas' else 0.0
+        self._exec(c, "INSERT INTO cierres (fecha_cierre, total_turno, responsable, tipo_cierre) VALUES (?,?,?,?)",
+                   (cierre.isoformat(" ", timespec="microseconds"), total, 'Importación', 'IMPORTACION'))
+
+class SQLiteBackend(StorageBackend):
+    Error = sqlite3.Error
+
+    def __init__(self, db_name):
+        self.ARCHIVO = db_name
+
+    @contextmanager
+    def _conexion(self):
+        # timeout: con varias cajas a la vez se espera el bloqueo en vez de fallar
+        conn = sqlite3.connect(self.ARCHIVO, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _conexion_masiva(self):
+        # Transacción manual: SAVEPOINT no convive con el BEGIN implícito de sqlite3
+        conn = sqlite3.connect(self.ARCHIVO, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("BEGIN")
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction: conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _diferir_indices(self, c, tabla):
+        c.execute("SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL", (tabla,))
+        diferidos = c.fetchall()
+        for tipo_obj, nombre, _ in diferidos:
+            c.execute(f'DROP {tipo_obj.upper()} IF EXISTS "{nombre}"')
+        return diferidos
+
+    def _restaurar_indices(self, c, tabla, diferidos):
+        for _, _, ddl in diferidos:
+            c.execute(ddl)
+
+    def init_schema(self):
+        conn = sqlite3.connect(self.ARCHIVO)
+        c = conn.cursor()
+
+        # Tablas base
+        c.execute('''CREATE TABLE IF NOT EXISTS menu (id INTEGER PRIMARY KEY, nombre TEXT, precio REAL, categoria TEXT)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS insumos (id INTEGER PRIMARY KEY, nombre TEXT, cantidad REAL, unidad TEXT, minimo REAL DEFAULT 10)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS recetas (id INTEGER PRIMARY KEY, menu_id INTEGER, insumo_id INTEGER, cantidad_insumo REAL)''')
+
+        # VENTAS ACTUALIZADA: Ahora guarda cant_toppings y cant_conos para poder devolverlos
+        c.execute('''CREATE TABLE IF NOT EXISTS ventas (id INTEGER PRIMARY KEY, producto_nombre TEXT, precio_base REAL, cantidad INTEGER, extras REAL, total REAL, metodo_pago TEXT, fecha TIMESTAMP, cant_toppings INTEGER DEFAULT 0, cant_conos INTEGER DEFAULT 0, menu_id INTEGER, origen TEXT)''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS mermas (id INTEGER PRIMARY KEY, insumo_nombre TEXT, cantidad REAL, razon TEXT, fecha TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS movimientos (id INTEGER PRIMARY KEY, insumo_nombre TEXT, cantidad REAL, tipo TEXT, razon TEXT, fecha TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS cierres (id INTEGER PRIMARY KEY, fecha_cierre TIMESTAMP, total_turno REAL, responsable TEXT, tipo_cierre TEXT)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS reportes_pdf (id INTEGER PRIMARY KEY, fecha TIMESTAMP, nombre_archivo TEXT, pdf_data BLOB)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS gastos (id INTEGER PRIMARY KEY, razon TEXT, monto REAL, metodo_pago TEXT, fecha TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS teclas_rapidas (posicion INTEGER PRIMARY KEY, menu_id INTEGER)''')
+
+        # --- MIGRACIONES PARA BASES DE DATOS ANTIGUAS ---
+        try:
+            c.execute("SELECT cant_toppings FROM ventas LIMIT 1")
+        except:
+            # Si falla, agregamos las columnas nuevas
+            c.execute("ALTER TABLE ventas ADD COLUMN cant_toppings INTEGER DEFAULT 0")
+            c.execute("ALTER TABLE ventas ADD COLUMN cant_conos INTEGER DEFAULT 0")
+
+        try:
+            c.execute("SELECT tipo_cierre FROM cierres LIMIT 1")
+        except:
+            c.execute("ALTER TABLE cierres ADD COLUMN tipo_cierre TEXT")
+
+        try:
+            c.execute("SELECT menu_id FROM ventas LIMIT 1")
+        except:
+            # Ventas antiguas quedan con menu_id NULL y se resuelven por nombre
+            c.execute("ALTER TABLE ventas ADD COLUMN menu_id INTEGER")
+
+        try:
+            c.execute("SELECT origen FROM ventas LIMIT 1")
+        except:
+            c.execute("ALTER TABLE ventas ADD COLUMN origen TEXT")
+
+        conn.commit()
+        conn.close()
+
+
+class PostgresBackend(StorageBackend):
+    """
+    PostgreSQL con pool de conexiones (psycopg_pool). psycopg prepara en
+    el servidor las consultas que se repiten en una conexión
+    (prepare_threshold), así que las de la caja se planifican una sola vez.
+    """
+    LIKE = "ILIKE"  # LIKE de SQLite ignora mayúsculas; el de Postgres no
+
+    def __init__(self, dsn, min_size=1, max_size=10, prepare_threshold=2):
+        # Dependencia opcional: solo se necesita al usar PostgreSQL
+        import psycopg
+        from psycopg_pool import ConnectionPool
+        self.Error = psycopg.Error
+        self.pool = ConnectionPool(dsn, min_size=min_size, max_size=max_size, open=True,
+                                   kwargs={"prepare_threshold": prepare_threshold,
+                                           "options": f"-c timezone={ZONA}"})
+        self._iniciado = False
+
+    def close(self):
+        self.pool.close()
+
+    @contextmanager
+    def _conexion(self):
+        # El pool hace commit al salir y rollback si hay excepción
+        with self.pool.connection() as conn:
+            yield conn
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _traducir(query):
+        return query.replace('%', '%%').replace('?', '%s')
+
+    def _sql(self, query):
+        return self._traducir(query)
+
+    def _sql_insert(self, query):
+        # Equivalente a lastrowid: la primera columna de la fila insertada
+        if query.lstrip().upper().startswith("INSERT") and "RETURNING" not in query.upper():
+            return query + " RETURNING *"
+        return query
+
+    def _ultimo_id(self, c):
+        row = c.fetchone() if c.description else None
+        return row[0] if row else None
+
+    def _diferir_indices(self, c, tabla):
+        # Índices que no respaldan una restricción (PK/UNIQUE se mantienen)
+        c.execute("""SELECT indexname, indexdef FROM pg_indexes
+                     WHERE schemaname = current_schema() AND tablename = %s
+                       AND indexname NOT IN (SELECT conname FROM pg_constraint)""", (tabla,))
+        indices = c.fetchall()
+        for nombre, _ in indices:
+            c.execute(f'DROP INDEX "{nombre}"')
+        c.execute(f"ALTER TABLE {tabla} DISABLE TRIGGER USER")
+        return indices
+
+    def _restaurar_indices(self, c, tabla, diferidos):
+        c.execute(f"ALTER TABLE {tabla} ENABLE TRIGGER USER")
+        for _, ddl in diferidos:
+            c.execute(ddl)
+
+    def init_schema(self):
+        # El pool vive todo el proceso: basta con crear el esquema una vez
+        if self._iniciado:
+            return
+        with self._conexion() as conn:
+            c = conn.cursor()
+            c.execute('''CREATE TABLE IF NOT EXISTS menu (id SERIAL PRIMARY KEY, nombre TEXT, precio DOUBLE PRECISION, categoria TEXT)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS insumos (id SERIAL PRIMARY KEY, nombre TEXT, cantidad DOUBLE PRECISION, unidad TEXT, minimo DOUBLE PRECISION DEFAULT 10)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS recetas (id SERIAL PRIMARY KEY, menu_id INTEGER, insumo_id INTEGER, cantidad_insumo DOUBLE PRECISION)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS ventas (id SERIAL PRIMARY KEY, producto_nombre TEXT, precio_base DOUBLE PRECISION, cantidad INTEGER, extras DOUBLE PRECISION, total DOUBLE PRECISION, metodo_pago TEXT, fecha TIMESTAMPTZ, cant_toppings INTEGER DEFAULT 0, cant_conos INTEGER DEFAULT 0, menu_id INTEGER, origen TEXT)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS mermas (id SERIAL PRIMARY KEY, insumo_nombre TEXT, cantidad DOUBLE PRECISION, razon TEXT, fecha TIMESTAMPTZ)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS movimientos (id SERIAL PRIMARY KEY, insumo_nombre TEXT, cantidad DOUBLE PRECISION, tipo TEXT, razon TEXT, fecha TIMESTAMPTZ)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS cierres (id SERIAL PRIMARY KEY, fecha_cierre TIMESTAMPTZ, total_turno DOUBLE PRECISION, responsable TEXT, tipo_cierre TEXT)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS reportes_pdf (id SERIAL PRIMARY KEY, fecha TIMESTAMPTZ, nombre_archivo TEXT, pdf_data BYTEA)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS gastos (id SERIAL PRIMARY KEY, razon TEXT, monto DOUBLE PRECISION, metodo_pago TEXT, fecha TIMESTAMPTZ)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS teclas_rapidas (posicion INTEGER PRIMARY KEY, menu_id INTEGER)''')
+
+            # Índices para las agregaciones por fecha y el descuento de stock
+            c.execute("CREATE INDEX IF NOT EXISTS ventas_fecha_idx ON ventas (fecha)")
+            c.execute("CREATE INDEX IF NOT EXISTS gastos_fecha_idx ON gastos (fecha)")
+            c.execute("CREATE INDEX IF NOT EXISTS recetas_menu_idx ON recetas (menu_id)")
+        self._iniciado = True
+
+    # --- Agregaciones en el servidor ---
+    def _filtro_periodo(self, desde, hasta):
+        condiciones, params = [], []
+        if desde is not None:
+            condiciones.append("fecha > ?")
+            params.append(desde)
+        if hasta is not None:
+            condiciones.append("fecha < ?")
+            params.append(hasta)
+        return (" WHERE " + " AND ".join(condiciones)) if condiciones else "", params
+
+    def _periodo(self, tabla, desde, hasta):
+        where, params = self._filtro_periodo(desde, hasta)
+        df = self.run_query(f"SELECT * FROM {tabla}{where} ORDER BY id DESC", params, return_data=True)
+        if not df.empty:
+            df['fecha'] = pd.to_datetime(df['fecha'], utc=True, format='ISO8601').dt.tz_convert(ZONA)
+        return df
+
+    def _suma(self, tabla, columna, desde, hasta):
+        where, params = self._filtro_periodo(desde, hasta)
+        df = self.run_query(f"SELECT COALESCE(SUM({columna}), 0) AS total FROM {tabla}{where}", params, return_data=True)
+        return float(df.iloc[0]['total'])
+
+    def total_ventas(self, desde=None, hasta=None):
+        return self._suma('ventas', 'total', desde, hasta)
+
+    def total_gastos(self, desde=None, hasta=None):
+        return self._suma('gastos', 'monto', desde, hasta)
+
+    def producto_estrella(self, desde=None, hasta=None):
+        where, params = self._filtro_periodo(desde, hasta)
+        df = self.run_query(f"""SELECT producto_nombre, SUM(cantidad) AS cant FROM ventas{where}
+                                GROUP BY producto_nombre ORDER BY cant DESC LIMIT 1""", params, return_data=True)
+        if df.empty:
+            return None, 0
+        return df.iloc[0]['producto_nombre'], int(df.iloc[0]['cant'])
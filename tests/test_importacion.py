@@ -0,0 +1,103 @@
+"""
+Pruebas de la lectura y validación de archivos de importación (app.py).
+Usan un SQLiteBackend en un archivo temporal en lugar de la BD de la tienda.
+"""
+import io
+
+import pandas as pd
+import pytest
+
+import app
+from storage import SQLiteBackend
+
+
+class Archivo(io.BytesIO):
+    # Lo mínimo de un UploadedFile de Streamlit: bytes + nombre
+    def __init__(self, texto, name):
+        super().__init__(texto.encode("utf-8"))
+        self.name = name
+
+
+@pytest.fixture(autouse=True)
+def backend(tmp_path, monkeypatch):
+    b = SQLiteBackend(str(tmp_path / "test.db"))
+    b.init_schema()
+    monkeypatch.setattr(app, "get_backend", lambda: b)
+    return b
+
+
+@pytest.mark.parametrize("texto", [
+    "nombre;precio;categoria\nFresa Grande;10,50;Helado\nMora;4;Helado\n",
+    "nombre,precio,categoria\nFresa Grande,10.50,Helado\nMora,4,Helado\n",
+    'nombre,precio,categoria\n"Fresa, Grande",10.50,Helado\nMora,4,Helado\n',
+])
+def test_leer_csv_separador_y_decimal(texto):
+    df = app.leer_archivo_importacion(Archivo(texto, "menu.csv"))
+    ok, bad = app.validar_importacion(df, "Menú")
+    assert bad.empty
+    assert ok['precio'].tolist() == [10.5, 4.0]
+
+
+def test_recetas_rechaza_lineas_repetidas(backend):
+    menu = backend.run_query("INSERT INTO menu (nombre, precio, categoria) VALUES (?,?,?)", ("Fresa", 5.0, "Helado"))
+    leche = backend.run_query("INSERT INTO insumos (nombre, cantidad, unidad, minimo) VALUES (?,?,?,?)", ("Leche", 10.0, "L", 1))
+    backend.run_query("INSERT INTO insumos (nombre, cantidad, unidad, minimo) VALUES (?,?,?,?)", ("Cono", 10.0, "u", 1))
+    backend.run_query("INSERT INTO recetas (menu_id, insumo_id, cantidad_insumo) VALUES (?,?,?)", (menu, leche, 0.2))
+    texto = "producto,insumo,cantidad_insumo\nFresa,Leche,0.2\nFresa,Cono,1\nFresa,Cono,1\n"
+    ok, bad = app.validar_importacion(app.leer_archivo_importacion(Archivo(texto, "recetas.csv")), "Recetas")
+    assert ok['fila'].tolist() == [3]
+    assert bad['fila'].tolist() == [2, 4]
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("2025-01-12", "2025-01-12 00:00:00.000000-05:00"),
+    ("12/01/2025", "2025-01-12 00:00:00.000000-05:00"),
+    ("03/02/2025 14:30", "2025-02-03 14:30:00.000000-05:00"),
+    ("2025-01-12T10:00:00Z", "2025-01-12 05:00:00.000000-05:00"),
+    ("no es fecha", None),
+])
+def test_normalizar_fechas(texto, esperado):
+    assert app._normalizar_fechas(pd.Series([texto])).tolist() == [esperado]
+
+
+def _ventas(filas):
+    df = pd.DataFrame(filas, columns=["producto_nombre", "cantidad", "total", "fecha"])
+    return app.validar_importacion(df, "Ventas")
+
+
+@pytest.mark.parametrize("cantidad, fecha, motivo", [
+    (2, "12/01/2025", None),
+    (2.5, "12/01/2025", "'cantidad' debe ser entero"),
+    (-1, "12/01/2025", "'cantidad' negativo"),
+    (0, "12/01/2025", "'cantidad' debe ser mayor a 0"),
+    ("dos", "12/01/2025", "'cantidad' no es número"),
+    (2, "13/01/2052", "'fecha' en el futuro"),
+    (2, "31/02/2025", "'fecha' inválida"),
+])
+def test_validar_ventas(cantidad, fecha, motivo):
+    ok, bad = _ventas([("Fresa", cantidad, 10.0, fecha)])
+    if motivo is None:
+        assert bad.empty
+        assert ok.iloc[0]['fecha'] == "2025-01-12 00:00:00.000000-05:00"
+        assert ok.iloc[0]['precio_base'] == 5.0
+    else:
+        assert bad['motivo'].tolist() == [motivo]
+
+
+def test_validar_fecha_de_hoy_no_es_futura():
+    ahora = app.get_hora_peru() - pd.Timedelta(minutes=1)
+    ok, bad = _ventas([("Fresa", 1, 5.0, ahora.strftime("%Y-%m-%d %H:%M:%S"))])
+    assert bad.empty
+
+
+def test_validar_nombres_repetidos(backend):
+    backend.run_query("INSERT INTO menu (nombre, precio, categoria) VALUES (?,?,?)", ("Fresa", 5.0, "Helado"))
+    df = pd.DataFrame({"nombre": ["Fresa", "Mora", "Mora", "Lúcuma"], "precio": [5, 4, 4, 6]})
+    ok, bad = app.validar_importacion(df, "Menú")
+    assert ok['nombre'].tolist() == ["Mora", "Lúcuma"]
+    assert bad['motivo'].tolist() == ["'nombre' ya existe", "'nombre' repetido en el archivo"]
+
+
+def test_validar_faltan_columnas():
+    with pytest.raises(ValueError, match="precio"):
+        app.validar_importacion(pd.DataFrame({"nombre": ["Fresa"]}), "Menú")
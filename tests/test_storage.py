@@ -0,0 +1,223 @@
+"""
+Pruebas de los backends de storage.py.
+
+SQLite usa un archivo temporal. PostgreSQL solo corre si existe
+HELADERIA_TEST_PG con el DSN de una BD de prueba (¡se borran sus tablas!):
+
+    HELADERIA_TEST_PG=postgresql://postgres@localhost/heladeria_test python -m pytest
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+import pytz
+
+from storage import SQLiteBackend, PostgresBackend, ORIGEN_IMPORTACION
+
+PG_DSN = os.environ.get("HELADERIA_TEST_PG")
+TABLAS = ['menu', 'insumos', 'recetas', 'ventas', 'mermas', 'movimientos', 'cierres', 'reportes_pdf', 'gastos', 'teclas_rapidas']
+LIMA = pytz.timezone('America/Lima')
+DIA = LIMA.localize(datetime(2025, 3, 10))
+
+
+def _sqlite(tmp_path):
+    return SQLiteBackend(str(tmp_path / "test.db"))
+
+
+def _postgres():
+    if not PG_DSN:
+        pytest.skip("HELADERIA_TEST_PG no está definido")
+    import psycopg
+    with psycopg.connect(PG_DSN, autocommit=True) as conn:
+        for tabla in TABLAS:
+            conn.execute(f"DROP TABLE IF EXISTS {tabla} CASCADE")
+    return PostgresBackend(PG_DSN, max_size=8)
+
+
+def _crear(nombre, tmp_path):
+    backend = _sqlite(tmp_path) if nombre == "sqlite" else _postgres()
+    backend.init_schema()
+    return backend
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request, tmp_path):
+    b = _crear(request.param, tmp_path)
+    yield b
+    if isinstance(b, PostgresBackend):
+        b.close()
+
+
+def _cargar_menu(b):
+    leche = b.run_query("INSERT INTO insumos (nombre, cantidad, unidad, minimo) VALUES (?,?,?,?)", ("Leche", 100.0, "L", 10))
+    b.run_query("INSERT INTO insumos (nombre, cantidad, unidad, minimo) VALUES (?,?,?,?)", ("Cono", 50.0, "u", 10))
+    b.run_query("INSERT INTO insumos (nombre, cantidad, unidad, minimo) VALUES (?,?,?,?)", ("Topping", 50.0, "u", 10))
+    ids = {}
+    for nombre, precio, receta in [("Fresa", 5.0, 1.0), ("Mora", 4.0, 2.0)]:
+        ids[nombre] = b.run_query("INSERT INTO menu (nombre, precio, categoria) VALUES (?,?,?)", (nombre, precio, "Helado"))
+        b.run_query("INSERT INTO recetas (menu_id, insumo_id, cantidad_insumo) VALUES (?,?,?)", (ids[nombre], leche, receta))
+    return ids
+
+
+def _item(ids, nombre, precio, cantidad, conos=0, toppings=0):
+    return {"menu_id": ids[nombre], "producto": nombre, "precio_base": precio, "cantidad": cantidad,
+            "cant_toppings": toppings, "cant_conos": conos, "extras_costo": conos + toppings,
+            "subtotal": precio * cantidad + conos + toppings}
+
+
+def _stock(b):
+    df = b.run_query("SELECT nombre, cantidad FROM insumos", return_data=True)
+    return dict(zip(df['nombre'], df['cantidad']))
+
+
+def _cargar_periodos(b):
+    # Día anterior: 4 Fresa. DIA: 2 Fresa + 5 Mora. Gastos en ambos días.
+    ids = _cargar_menu(b)
+    b.registrar_venta([_item(ids, "Fresa", 5.0, 4)], "Efectivo", DIA - timedelta(hours=3))
+    b.registrar_venta([_item(ids, "Fresa", 5.0, 2), _item(ids, "Mora", 4.0, 5, conos=1)], "Yape", DIA + timedelta(hours=10))
+    b.run_query("INSERT INTO gastos (razon, monto, metodo_pago, fecha) VALUES (?,?,?,?)", ("Hielo", 7.5, "Efectivo", DIA - timedelta(hours=2)))
+    b.run_query("INSERT INTO gastos (razon, monto, metodo_pago, fecha) VALUES (?,?,?,?)", ("Luz", 30.0, "Efectivo", DIA + timedelta(hours=11)))
+
+
+def _agregaciones(b):
+    desde, hasta = DIA, DIA + timedelta(days=1)
+    return {
+        "ventas_dia": b.total_ventas(desde, hasta),
+        "ventas_todo": b.total_ventas(),
+        "gastos_dia": b.total_gastos(desde, hasta),
+        "gastos_todo": b.total_gastos(),
+        "estrella_dia": b.producto_estrella(desde, hasta),
+        "estrella_todo": b.producto_estrella(),
+        "ventas_periodo": len(b.ventas_periodo(desde, hasta)),
+    }
+
+
+def test_registrar_venta_descuenta_stock(backend):
+    ids = _cargar_menu(backend)
+    backend.registrar_venta([_item(ids, "Fresa", 5.0, 3, conos=1), _item(ids, "Mora", 4.0, 2, toppings=1)],
+                            "Efectivo", DIA)
+
+    assert _stock(backend) == {"Leche": 93.0, "Cono": 49.0, "Topping": 49.0}
+    df = backend.run_query("SELECT producto_nombre, menu_id, total FROM ventas ORDER BY id", return_data=True)
+    assert df['producto_nombre'].tolist() == ["Fresa", "Mora"]
+    assert df['menu_id'].tolist() == [ids["Fresa"], ids["Mora"]]
+    assert df['total'].tolist() == [16.0, 9.0]
+    salidas = backend.run_query("SELECT COUNT(*) AS n FROM movimientos WHERE tipo = 'SALIDA'", return_data=True)
+    assert salidas.iloc[0]['n'] == 4
+
+
+def test_ventas_concurrentes_con_recetas_cruzadas(backend):
+    # Fresa baja los insumos en un orden y Mora en el inverso. Antes cada
+    # caja los bloqueaba en el orden de su receta y PostgreSQL abortaba
+    # ventas por interbloqueo
+    insumos = [backend.run_query("INSERT INTO insumos (nombre, cantidad, unidad, minimo) VALUES (?,?,?,?)", (f"Insumo {k}", 1000.0, "u", 10))
+               for k in range(4)]
+    ids = {}
+    for nombre, orden in [("Fresa", insumos), ("Mora", insumos[::-1])]:
+        ids[nombre] = backend.run_query("INSERT INTO menu (nombre, precio, categoria) VALUES (?,?,?)", (nombre, 5.0, "Helado"))
+        for insumo in orden:
+            backend.run_query("INSERT INTO recetas (menu_id, insumo_id, cantidad_insumo) VALUES (?,?,?)", (ids[nombre], insumo, 1.0))
+
+    def caja(n):
+        for i in range(25):
+            backend.registrar_venta([_item(ids, "Fresa" if (n + i) % 2 else "Mora", 5.0, 1)], "Efectivo", DIA)
+
+    with ThreadPoolExecutor(8) as ex:
+        list(ex.map(caja, range(8)))
+    assert set(_stock(backend).values()) == {800.0}
+
+
+def test_eliminar_ventas_restaura_stock_salvo_importadas(backend):
+    ids = _cargar_menu(backend)
+    backend.registrar_venta([_item(ids, "Fresa", 5.0, 3, conos=2), _item(ids, "Mora", 4.0, 1)], "Efectivo", DIA)
+    # Venta importada: nunca descontó stock, no debe devolverlo
+    backend.insertar_masivo('ventas', ['producto_nombre', 'precio_base', 'cantidad', 'total', 'fecha', 'origen'],
+                            [("Fresa", 5.0, 10, 50.0, "2025-01-05 10:00:00.000000-05:00", ORIGEN_IMPORTACION)], [2], 500, DIA)
+
+    venta_ids = backend.run_query("SELECT id FROM ventas", return_data=True)['id'].tolist()
+    assert len(venta_ids) == 3
+    backend.eliminar_ventas(venta_ids, DIA)
+
+    assert _stock(backend) == {"Leche": 100.0, "Cono": 50.0, "Topping": 50.0}
+    assert backend.run_query("SELECT COUNT(*) AS n FROM ventas", return_data=True).iloc[0]['n'] == 0
+    devoluciones = backend.run_query("SELECT COUNT(*) AS n FROM movimientos WHERE tipo = 'DEVOLUCIÓN'", return_data=True)
+    assert devoluciones.iloc[0]['n'] == 3
+
+
+def test_cerrar_turno(backend):
+    backend.cerrar_turno(123.5, "Ana", "TURNO", DIA)
+    df = backend.run_query("SELECT total_turno, responsable, tipo_cierre FROM cierres", return_data=True)
+    assert df.to_dict('records') == [{"total_turno": 123.5, "responsable": "Ana", "tipo_cierre": "TURNO"}]
+
+
+def test_guardar_pdf(backend):
+    datos = b"%PDF-1.4\x00\xff contenido binario"
+    backend.guardar_pdf("Turno.pdf", datos, DIA)
+    df = backend.run_query("SELECT nombre_archivo, pdf_data FROM reportes_pdf", return_data=True)
+    assert df.iloc[0]['nombre_archivo'] == "Turno.pdf"
+    assert bytes(df.iloc[0]['pdf_data']) == datos
+
+
+def test_insertar_masivo_rechaza_fila_mala(backend):
+    # posicion es PRIMARY KEY: la fila repetida falla solo ella
+    cargadas, rechazos = backend.insertar_masivo('teclas_rapidas', ['posicion', 'menu_id'],
+                                                 [(1, 10), (1, 11), (2, 12)], [2, 3, 4], 500, DIA)
+    assert cargadas == [(1, 10), (2, 12)]
+    assert [r['fila'] for r in rechazos] == [3]
+    df = backend.run_query("SELECT posicion, menu_id FROM teclas_rapidas ORDER BY posicion", return_data=True)
+    assert df.values.tolist() == [[1, 10], [2, 12]]
+
+
+def test_insertar_masivo_ventas_registra_cierre(backend):
+    filas = [("Fresa", 5.0, 2, 10.0, "2025-01-05 10:00:00.000000-05:00", ORIGEN_IMPORTACION),
+             ("Mora", 4.0, 1, 4.0, "2025-02-01 09:00:00.000000-05:00", ORIGEN_IMPORTACION)]
+    backend.insertar_masivo('ventas', ['producto_nombre', 'precio_base', 'cantidad', 'total', 'fecha', 'origen'],
+                            filas, [2, 3], 500, DIA)
+
+    df = backend.run_query("SELECT total_turno, tipo_cierre FROM cierres", return_data=True)
+    assert df.to_dict('records') == [{"total_turno": 14.0, "tipo_cierre": "IMPORTACION"}]
+    # Lo importado queda antes del cierre: no cuenta para el turno actual
+    ultimo = backend.run_query("SELECT fecha_cierre FROM cierres", return_data=True).iloc[0]['fecha_cierre']
+    assert backend.total_ventas(desde=pd.to_datetime(ultimo)) == 0.0
+
+
+def test_cierre_importacion_no_oculta_ventas_de_caja(backend):
+    ids = _cargar_menu(backend)
+    backend.cerrar_turno(0.0, "Ana", "TURNO", DIA - timedelta(days=5))
+    backend.registrar_venta([_item(ids, "Fresa", 5.0, 1)], "Efectivo", DIA - timedelta(days=2))
+    # Historial que llega hasta después de la venta de caja
+    filas = [("Mora", 4.0, 1, 4.0, (DIA - timedelta(days=3)).isoformat(" ", timespec="microseconds"), ORIGEN_IMPORTACION),
+             ("Mora", 4.0, 2, 8.0, (DIA - timedelta(days=1)).isoformat(" ", timespec="microseconds"), ORIGEN_IMPORTACION)]
+    backend.insertar_masivo('ventas', ['producto_nombre', 'precio_base', 'cantidad', 'total', 'fecha', 'origen'],
+                            filas, [2, 3], 500, DIA)
+
+    df = backend.run_query("SELECT fecha_cierre, total_turno FROM cierres WHERE tipo_cierre = 'IMPORTACION'", return_data=True)
+    assert df['total_turno'].tolist() == [4.0]
+    # La venta de caja sigue en el turno actual
+    assert backend.total_ventas(desde=pd.to_datetime(df.iloc[0]['fecha_cierre'])) == 13.0
+
+
+def test_agregaciones(backend):
+    _cargar_periodos(backend)
+    assert _agregaciones(backend) == {
+        "ventas_dia": 31.0,
+        "ventas_todo": 51.0,
+        "gastos_dia": 30.0,
+        "gastos_todo": 37.5,
+        "estrella_dia": ("Mora", 5),
+        "estrella_todo": ("Fresa", 6),
+        "ventas_periodo": 2,
+    }
+
+
+def test_agregaciones_coinciden_entre_backends(tmp_path):
+    pg = _crear("postgres", tmp_path)
+    try:
+        lite = _crear("sqlite", tmp_path)
+        _cargar_periodos(lite)
+        _cargar_periodos(pg)
+        assert _agregaciones(pg) == _agregaciones(lite)
+    finally:
+        pg.close()